@@ -32,21 +32,6 @@ st.markdown("""
         text-align: center;
         margin-bottom: 2rem;
     }
-    .chat-message {
-        padding: 1rem;
-        border-radius: 0.5rem;
-        margin-bottom: 1rem;
-        border: 1px solid #E0E0E0;
-        white-space: pre-wrap;
-    }
-    .user-message {
-        background-color: #E3F2FD;
-        border-left: 4px solid #2196F3;
-    }
-    .bot-message {
-        background-color: #F5F5F5;
-        border-left: 4px solid #4CAF50;
-    }
     .source-item {
         background-color: #FFF3E0;
         padding: 0.5rem;
@@ -71,9 +56,45 @@ if 'rag_system' not in st.session_state:
     st.session_state.rag_system = None
 if 'initialized' not in st.session_state:
     st.session_state.initialized = False
+if 'index_version' not in st.session_state:
+    st.session_state.index_version = None
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def get_rag_system(index_path, index_mtimes):
+    """Load the RAG system once per version of the saved index and share it across sessions"""
+    return load_rag_system(index_path)
+
+@st.cache_data(show_spinner=False, max_entries=1000, ttl=86400)
+def cached_answer(question: str, k: int, index_version, _qa) -> dict:
+    """Memoize answers per saved index version so repeated questions skip retrieval"""
+    return _qa.answer_question(question, k)
+
+def _index_files(index_path):
+    """Files written by AgnosRAG.save_index"""
+    return [
+        f"{index_path}_bm25.npz",
+        f"{index_path}_matrix.npz",
+        f"{index_path}_metadata.json",
+        f"{index_path}_meta.arrow",
+    ]
+
+def _index_mtimes(index_path):
+    """Modification times of the saved index, used as the cache key for loading it"""
+    return tuple(os.path.getmtime(path) for path in _index_files(index_path))
+
+def _index_ready(index_path, *input_paths):
+    """Whether all saved index files exist and are newer than the input files"""
+    index_files = _index_files(index_path)
+    if not all(map(os.path.exists, index_files)):
+        return False
+    inputs = [os.path.getmtime(path) for path in input_paths if os.path.exists(path)]
+    return not inputs or min(map(os.path.getmtime, index_files)) >= max(inputs)
 
 def initialize_system():
     """Initialize the RAG system"""
+    if st.session_state.get('initialized'):
+        return True
+    
     try:
         with st.spinner("กำลังโหลดระบบ Agnos Health Assistant..."):
             # Configuration
@@ -81,22 +102,22 @@ def initialize_system():
             SCRAPED_DATA_FILE = "scraped_threads.json"
             INDEX_PATH = "agnos_health_index"
             
-            # Check if index exists, otherwise build it
-            if (os.path.exists(f"{INDEX_PATH}_vectorizer.pkl") and 
-                os.path.exists(f"{INDEX_PATH}_matrix.pkl") and 
-                os.path.exists(f"{INDEX_PATH}_metadata.pkl")):
-                
-                st.session_state.rag_system = load_rag_system(INDEX_PATH)
-                st.success("✅ ระบบโหลดข้อมูลฟอรัมสำเร็จ!")
-                
-            else:
-                if os.path.exists(THREAD_URLS_FILE):
-                    st.info("🔄 กำลังสร้างระบบค้นหาจากข้อมูลฟอรัม... (อาจใช้เวลาสักครู่)")
-                    st.session_state.rag_system = build_rag_system(THREAD_URLS_FILE, SCRAPED_DATA_FILE, INDEX_PATH)
-                    st.success("✅ สร้างระบบค้นหาจากข้อมูลฟอรัมสำเร็จ!")
-                else:
+            # Check if an up-to-date index exists, otherwise (re)build it
+            index_ready = _index_ready(INDEX_PATH, THREAD_URLS_FILE, SCRAPED_DATA_FILE)
+            if not index_ready:
+                if not os.path.exists(THREAD_URLS_FILE):
                     st.error("❌ ไม่พบไฟล์ threads.txt กรุณาเพิ่ม URL กระทู้ในไฟล์ก่อน")
                     return False
+                st.info("🔄 กำลังสร้างระบบค้นหาจากข้อมูลฟอรัม... (อาจใช้เวลาสักครู่)")
+                build_rag_system(THREAD_URLS_FILE, SCRAPED_DATA_FILE, INDEX_PATH)
+            
+            # One shared copy per process, reloaded only when the saved index changes
+            st.session_state.index_version = _index_mtimes(INDEX_PATH)
+            st.session_state.rag_system = get_rag_system(INDEX_PATH, st.session_state.index_version)
+            if index_ready:
+                st.success("✅ ระบบโหลดข้อมูลฟอรัมสำเร็จ!")
+            else:
+                st.success("✅ สร้างระบบค้นหาจากข้อมูลฟอรัมสำเร็จ!")
             
             st.session_state.initialized = True
             return True
@@ -106,14 +127,84 @@ def initialize_system():
         return False
 
 def get_confidence_color(confidence):
-    """Get color based on confidence score"""
-    if confidence > 0.3:
+    """Get color based on confidence score (cosine between the query and the best thread)"""
+    if confidence > 0.1:
         return "confidence-high"
-    elif confidence > 0.1:
+    elif confidence > 0.06:
         return "confidence-medium"
     else:
         return "confidence-low"
 
+def ask_question(question):
+    """Append a question and its answer to the chat history"""
+    # Add user message
+    st.session_state.messages.append({"role": "user", "content": question})
+    
+    # Get bot response
+    with st.spinner("🔍 กำลังค้นหาข้อมูลจากฟอรัม..."):
+        response = cached_answer(question, 3, st.session_state.index_version, st.session_state.rag_system)
+    
+    # Add bot response
+    st.session_state.messages.append({
+        "role": "assistant", 
+        "content": response['answer'],
+        "confidence": response['confidence'],
+        "sources": response['sources']
+    })
+
+def on_chat_submit():
+    """Answer the submitted chat input before the chat panel reruns"""
+    ask_question(st.session_state.chat_input)
+
+@st.fragment
+def chat_panel():
+    """Chat history and input; reruns on its own when a question is submitted"""
+    st.subheader("💬 สนทนา")
+    
+    # Display chat messages
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.write(message["content"])
+            
+            if message["role"] == "assistant":
+                # Bot message with confidence
+                confidence_color = get_confidence_color(message.get("confidence", 0))
+                st.markdown(
+                    f"<small class='{confidence_color}'>ความมั่นใจ: {message.get('confidence', 0):.2f}</small>",
+                    unsafe_allow_html=True
+                )
+            
+            # Show sources if available
+            if message.get("sources"):
+                with st.expander("📚 แหล่งข้อมูลอ้างอิง"):
+                    for i, source in enumerate(message["sources"]):
+                        st.markdown(f"""
+                        <div class="source-item">
+                            <strong>#{i+1}: {source['title']}</strong><br>
+                            <small>URL: {source['url']}</small><br>
+                            <small>คะแนนความเกี่ยวข้อง: {source['score']:.3f}</small>
+                        </div>
+                        """, unsafe_allow_html=True)
+    
+    # Chat input (answered in the submit callback, so the history above is already up to date)
+    st.markdown("---")
+    st.chat_input("พิมพ์คำถามเกี่ยวกับสุขภาพที่นี่...", key="chat_input", on_submit=on_chat_submit)
+
+def example_panel():
+    """Example question buttons; answered in the click callback before the chat panel renders"""
+    st.subheader("💡 คำถามตัวอย่าง")
+    example_questions = [
+        "กระเพาะปัสสาวะอักเสบรักษาอย่างไร",
+        "อาการน้ำในหูไม่เท่ากันเป็นอย่างไร",
+        "ปวดท้องประจำเดือนควรทำอย่างไร",
+        "โรคซึมเศร้ามีอาการอย่างไร",
+        "วิธีการดูแลสุขภาพจิต",
+        "อาหารสำหรับผู้ป่วยโรคกระเพาะ"
+    ]
+    
+    for question in example_questions:
+        st.button(question, key=question, on_click=ask_question, args=(question,))
+
 def main():
     # Header
     st.markdown('<h1 class="main-header">🏥 Agnos Health Forum Assistant</h1>', unsafe_allow_html=True)
@@ -142,7 +233,7 @@ def main():
         
         st.header("สถิติ")
         if st.session_state.rag_system:
-            st.write(f"📚 จำนวนข้อมูล: {len(st.session_state.rag_system.rag.metadata)} กระทู้")
+            st.write(f"📚 จำนวนข้อมูล: {st.session_state.rag_system.rag.meta_tbl.num_rows} กระทู้")
         st.write(f"💬 จำนวนข้อความ: {len(st.session_state.messages)}")
         
         if st.button("ล้างประวัติการสนทนา"):
@@ -150,99 +241,17 @@ def main():
             st.rerun()
     
     # Initialize system if not done
-    if not st.session_state.initialized:
-        if initialize_system():
-            st.session_state.initialized = True
-        else:
-            st.stop()
+    if not initialize_system():
+        st.stop()
     
     # Chat interface
     col1, col2 = st.columns([3, 1])
     
     with col1:
-        st.subheader("💬 สนทนา")
-        
-        # Display chat messages
-        for message in st.session_state.messages:
-            if message["role"] == "user":
-                st.markdown(f"""
-                <div class="chat-message user-message">
-                    <strong>คุณ:</strong> {message["content"]}
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                # Bot message with confidence
-                confidence_color = get_confidence_color(message.get("confidence", 0))
-                confidence_text = f"<span class='{confidence_color}'>ความมั่นใจ: {message.get('confidence', 0):.2f}</span>"
-                
-                st.markdown(f"""
-                <div class="chat-message bot-message">
-                    <strong>ผู้ช่วย:</strong> {message["content"]}<br>
-                    <small>{confidence_text}</small>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # Show sources if available
-                if message.get("sources"):
-                    with st.expander("📚 แหล่งข้อมูลอ้างอิง"):
-                        for i, source in enumerate(message["sources"]):
-                            st.markdown(f"""
-                            <div class="source-item">
-                                <strong>#{i+1}: {source['title']}</strong><br>
-                                <small>URL: {source['url']}</small><br>
-                                <small>คะแนนความเกี่ยวข้อง: {source['score']:.3f}</small>
-                            </div>
-                            """, unsafe_allow_html=True)
+        chat_panel()
     
     with col2:
-        st.subheader("💡 คำถามตัวอย่าง")
-        example_questions = [
-            "กระเพาะปัสสาวะอักเสบรักษาอย่างไร",
-            "อาการน้ำในหูไม่เท่ากันเป็นอย่างไร",
-            "ปวดท้องประจำเดือนควรทำอย่างไร",
-            "โรคซึมเศร้ามีอาการอย่างไร",
-            "วิธีการดูแลสุขภาพจิต",
-            "อาหารสำหรับผู้ป่วยโรคกระเพาะ"
-        ]
-        
-        for question in example_questions:
-            if st.button(question, key=question):
-                # Add to chat
-                st.session_state.messages.append({"role": "user", "content": question})
-                
-                # Get response
-                with st.spinner("กำลังค้นหาข้อมูล..."):
-                    response = st.session_state.rag_system.answer_question(question)
-                
-                st.session_state.messages.append({
-                    "role": "assistant", 
-                    "content": response['answer'],
-                    "confidence": response['confidence'],
-                    "sources": response['sources']
-                })
-                st.rerun()
-    
-    # Chat input
-    st.markdown("---")
-    user_input = st.chat_input("พิมพ์คำถามเกี่ยวกับสุขภาพที่นี่...")
-    
-    if user_input:
-        # Add user message
-        st.session_state.messages.append({"role": "user", "content": user_input})
-        
-        # Get bot response
-        with st.spinner("🔍 กำลังค้นหาข้อมูลจากฟอรัม..."):
-            response = st.session_state.rag_system.answer_question(user_input)
-        
-        # Add bot response
-        st.session_state.messages.append({
-            "role": "assistant", 
-            "content": response['answer'],
-            "confidence": response['confidence'],
-            "sources": response['sources']
-        })
-        
-        st.rerun()
+        example_panel()
 
 if __name__ == "__main__":
     main()
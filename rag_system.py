@@ -1,27 +1,36 @@
 """
 Simplified RAG System for Agnos Health Forum
-Uses TF-IDF instead of sentence transformers to avoid dependency issues
+Uses BM25 over hashed n-grams instead of sentence transformers to avoid dependency issues
 """
 
 import pandas as pd
 import numpy as np
-import faiss
-import pickle
+import scipy.sparse
 import json
+import orjson
+import pyarrow as pa
+import pyarrow.feather as feather
 from typing import List, Dict
 import re
 import asyncio
 import aiohttp
 from bs4 import BeautifulSoup
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.pipeline import Pipeline
 
 class ThreadScraper:
-    def __init__(self, max_concurrent=3):
+    def __init__(self, max_concurrent=10):
         self.max_concurrent = max_concurrent
     
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        # All threads live on one host, so the per-host pool matches the request concurrency
+        connector = aiohttp.TCPConnector(limit=50, limit_per_host=self.max_concurrent, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            # Per-socket timeouts, so time spent waiting for a pooled connection is not counted
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+        )
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -30,36 +39,36 @@ class ThreadScraper:
     async def scrape_thread(self, url: str) -> Dict:
         """Scrape individual thread content"""
         try:
-            async with self.session.get(url, timeout=30) as response:
+            async with self.session.get(url) as response:
                 if response.status == 200:
                     html = await response.text()
-                    soup = BeautifulSoup(html, 'html.parser')
+                    soup = BeautifulSoup(html, 'lxml')
                     
                     # Extract thread title
                     title = soup.find('h1') or soup.find('title')
                     title_text = title.get_text().strip() if title else "No title"
                     
-                    # Try to find main content area
-                    content_selectors = [
-                        'article', 'main', '.content', '.post-content', 
-                        '.thread-content', '.forum-content', '.entry-content'
-                    ]
+                    # Try to find main content area (single pass over the document)
+                    content_selector = (
+                        'article, main, .content, .post-content, '
+                        '.thread-content, .forum-content, .entry-content'
+                    )
                     
                     content_parts = []
-                    for selector in content_selectors:
-                        elements = soup.select(selector)
-                        for elem in elements:
-                            # Remove script and style elements
-                            for script in elem(["script", "style"]):
-                                script.decompose()
-                            text = elem.get_text().strip()
-                            if text and len(text) > 50:
-                                content_parts.append(text)
+                    for elem in soup.select(content_selector):
+                        # Remove script and style elements
+                        for script in elem(["script", "style"]):
+                            script.decompose()
+                        text = elem.get_text(' ', strip=True)
+                        if len(text) > 50:
+                            content_parts.append(text)
                     
                     # Fallback: get all paragraphs
                     if not content_parts:
-                        paragraphs = soup.find_all('p')
-                        content_parts = [p.get_text().strip() for p in paragraphs if len(p.get_text().strip()) > 30]
+                        for p in soup.find_all('p'):
+                            text = p.get_text(' ', strip=True)
+                            if len(text) > 30:
+                                content_parts.append(text)
                     
                     content = ' '.join(content_parts) if content_parts else title_text
                     
@@ -95,28 +104,58 @@ class ThreadScraper:
         print(f"Successfully scraped {len(valid_results)} out of {len(urls)} threads")
         return valid_results
 
+class BM25Transformer(BaseEstimator, TransformerMixin):
+    """Turn a term-count matrix into BM25 document weights"""
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+    
+    def fit(self, X, y=None):
+        X = scipy.sparse.csr_matrix(X)
+        n_docs = X.shape[0]
+        df = np.bincount(X.indices, minlength=X.shape[1])
+        self.idf_ = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        self.avgdl_ = float(X.sum()) / max(n_docs, 1)
+        return self
+    
+    def transform(self, X):
+        X = scipy.sparse.csr_matrix(X, dtype=np.float64, copy=True)
+        doc_len = np.asarray(X.sum(axis=1)).ravel()
+        row_len = np.repeat(doc_len, np.diff(X.indptr))
+        
+        # Saturated term frequency with document length normalization
+        tf = X.data
+        denom = tf + self.k1 * (1 - self.b + self.b * row_len / max(self.avgdl_, 1e-12))
+        X.data = self.idf_[X.indices] * tf * (self.k1 + 1) / denom
+        return X
+    
+
 class AgnosRAG:
+    # Special characters to strip; keeps Thai characters and basic punctuation.
+    # A single negated character class never backtracks, so re.sub stays linear in the text length.
+    _CHAR_RE = re.compile(r'[^\w\s\u0E00-\u0E7F.,!?\-]')
+
     def __init__(self):
         self.vectorizer = None
-        self.tfidf_matrix = None
+        self.term_matrix = None
+        self.doc_norms = None
         self.documents = []
-        self.metadata = []
+        self.meta_tbl = None
     
     def preprocess_text(self, text: str) -> str:
         """Clean and preprocess text"""
         if not text:
             return ""
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
-        # Remove special characters but keep Thai characters and basic punctuation
-        text = re.sub(r'[^\w\s\u0E00-\u0E7F.,!?\-]', ' ', text)
-        return text.strip().lower()
+        # Remove special characters, then collapse whitespace
+        return " ".join(self._CHAR_RE.sub(' ', text).lower().split())
     
     def build_index(self, documents: List[Dict]):
-        """Build TF-IDF index from documents"""
+        """Build BM25 index from documents"""
         self.documents = []
-        self.metadata = []
         
+        # Metadata is kept column-wise and only materialized for search hits
+        urls, titles, snippets = [], [], []
         texts = []
         for doc in documents:
             # Combine title and content for better retrieval
@@ -126,81 +165,123 @@ class AgnosRAG:
             if len(cleaned_text) > 50:  # Minimum text length
                 texts.append(cleaned_text)
                 self.documents.append(cleaned_text)
-                self.metadata.append({
-                    'url': doc.get('url', ''),
-                    'title': doc.get('title', ''),
-                    'original_content': doc.get('content', '')[:1000]  # Keep longer snippet
-                })
+                urls.append(doc.get('url', ''))
+                titles.append(doc.get('title', ''))
+                snippets.append(doc.get('content', '')[:1000])  # Keep longer snippet
+        
+        self.meta_tbl = pa.table({'url': urls, 'title': titles, 'original_content': snippets})
         
-        print(f"Building TF-IDF index with {len(texts)} documents...")
+        print(f"Building BM25 index with {len(texts)} documents...")
         
         if not texts:
             raise ValueError("No valid documents to index")
         
-        # Create TF-IDF vectors
-        self.vectorizer = TfidfVectorizer(
-            max_features=5000,
-            min_df=1,
-            max_df=0.8,
-            ngram_range=(1, 2)  # Use unigrams and bigrams
-        )
+        # Create BM25 document vectors (stateless hashing, so only the IDF weights are stored)
+        self.vectorizer = self._make_vectorizer()
         
-        self.tfidf_matrix = self.vectorizer.fit_transform(texts)
-        print(f"TF-IDF matrix shape: {self.tfidf_matrix.shape}")
+        # Document rows hold full BM25 term weights, so search is a single sparse dot product
+        self.term_matrix = self.vectorizer.fit_transform(texts).tocsr()
+        self.doc_norms = self._row_norms(self.term_matrix)
+        print(f"BM25 matrix shape: {self.term_matrix.shape}")
         print("Index built successfully!")
     
+    @staticmethod
+    def _make_vectorizer(k1: float = 1.5, b: float = 0.75) -> Pipeline:
+        """Hashed n-gram counts followed by BM25 weighting"""
+        return Pipeline([
+            ('hash', HashingVectorizer(
+                n_features=2**20,
+                ngram_range=(1, 2),  # Use unigrams and bigrams
+                alternate_sign=False,
+                norm=None
+            )),
+            ('bm25', BM25Transformer(k1=k1, b=b))
+        ])
+    
+    @staticmethod
+    def _row_norms(matrix) -> np.ndarray:
+        """Euclidean norm of every row of a sparse matrix"""
+        return np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    
     def save_index(self, index_path: str):
-        """Save TF-IDF index and metadata"""
-        with open(f"{index_path}_vectorizer.pkl", 'wb') as f:
-            pickle.dump(self.vectorizer, f)
-        
-        with open(f"{index_path}_matrix.pkl", 'wb') as f:
-            pickle.dump(self.tfidf_matrix, f)
-        
-        with open(f"{index_path}_metadata.pkl", 'wb') as f:
-            pickle.dump({
-                'documents': self.documents,
-                'metadata': self.metadata
-            }, f)
+        """Save BM25 index and metadata"""
+        # Only the fitted BM25 statistics are stored; the hashing step has no state
+        bm25 = self.vectorizer.named_steps['bm25']
+        np.savez_compressed(f"{index_path}_bm25.npz", idf=bm25.idf_, avgdl=bm25.avgdl_, k1=bm25.k1, b=bm25.b)
+        
+        scipy.sparse.save_npz(f"{index_path}_matrix.npz", self.term_matrix)
+        
+        with open(f"{index_path}_metadata.json", 'wb') as f:
+            f.write(orjson.dumps({'documents': self.documents}))
+        
+        # Uncompressed Arrow IPC so the table can be memory-mapped without decoding
+        feather.write_feather(self.meta_tbl, f"{index_path}_meta.arrow", compression='uncompressed')
     
     def load_index(self, index_path: str):
-        """Load TF-IDF index and metadata"""
-        with open(f"{index_path}_vectorizer.pkl", 'rb') as f:
-            self.vectorizer = pickle.load(f)
+        """Load BM25 index and metadata"""
+        with np.load(f"{index_path}_bm25.npz") as params:
+            self.vectorizer = self._make_vectorizer(k1=float(params['k1']), b=float(params['b']))
+            bm25 = self.vectorizer.named_steps['bm25']
+            bm25.idf_ = params['idf']
+            bm25.avgdl_ = float(params['avgdl'])
         
-        with open(f"{index_path}_matrix.pkl", 'rb') as f:
-            self.tfidf_matrix = pickle.load(f)
+        self.term_matrix = scipy.sparse.load_npz(f"{index_path}_matrix.npz").tocsr()
+        self.doc_norms = self._row_norms(self.term_matrix)
         
-        with open(f"{index_path}_metadata.pkl", 'rb') as f:
-            data = pickle.load(f)
+        with open(f"{index_path}_metadata.json", 'rb') as f:
+            data = orjson.loads(f.read())
             self.documents = data['documents']
-            self.metadata = data['metadata']
+        
+        self.meta_tbl = feather.read_table(f"{index_path}_meta.arrow", memory_map=True)
     
     def search(self, query: str, k: int = 5) -> List[Dict]:
-        """Search for similar documents using TF-IDF"""
-        if self.vectorizer is None or self.tfidf_matrix is None:
+        """Search for similar documents using BM25"""
+        if self.vectorizer is None or self.term_matrix is None:
             raise ValueError("Index not built. Call build_index() first.")
         
         # Preprocess query
         processed_query = self.preprocess_text(query)
         
-        # Transform query to TF-IDF vector
-        query_vector = self.vectorizer.transform([processed_query])
+        # Query terms count once each; the BM25 weights live on the document side
+        query_vector = self.vectorizer.named_steps['hash'].transform([processed_query]).tocsr()
+        query_vector.data[:] = 1.0
+        
+        k_eff = min(k, self.term_matrix.shape[0])
+        if k_eff <= 0 or query_vector.nnz == 0:
+            return []
+        
+        similarities = (self.term_matrix @ query_vector.T).toarray().ravel()
+        
+        # Get top k results (partial selection instead of a full sort)
+        if k_eff == 1:
+            top_indices = [int(similarities.argmax())]
+        else:
+            top_unsorted = np.argpartition(similarities, -k_eff)[-k_eff:]
+            top_indices = top_unsorted[np.argsort(-similarities[top_unsorted])]
+        
+        # Only include results with some similarity
+        hit_indices = [int(idx) for idx in top_indices if similarities[idx] > 0]
+        if not hit_indices:
+            return []
         
-        # Calculate cosine similarities
-        similarities = cosine_similarity(query_vector, self.tfidf_matrix).flatten()
+        # Report the cosine between each hit and the idf-weighted query; unlike raw BM25
+        # it stays on the same 0-1 scale across queries, so a single matching term scores low
+        query_weights = query_vector.multiply(self.vectorizer.named_steps['bm25'].idf_).tocsr()
+        query_norm = np.sqrt(query_weights.multiply(query_weights).sum())
+        dots = (self.term_matrix[hit_indices] @ query_weights.T).toarray().ravel()
+        cosines = dots / np.maximum(self.doc_norms[hit_indices] * query_norm, 1e-12)
+        hits = list(zip(hit_indices, cosines.tolist()))
         
-        # Get top k results
-        top_indices = similarities.argsort()[-k:][::-1]
+        # Pull only the returned rows out of the metadata table
+        rows = self.meta_tbl.take(pa.array(hit_indices)).to_pylist()
         
         results = []
-        for idx in top_indices:
-            if similarities[idx] > 0:  # Only include results with some similarity
-                results.append({
-                    'score': float(similarities[idx]),
-                    'content': self.documents[idx],
-                    'metadata': self.metadata[idx]
-                })
+        for (idx, score), row in zip(hits, rows):
+            results.append({
+                'score': score,
+                'content': self.documents[idx],
+                'metadata': row
+            })
         
         return results
 
@@ -260,7 +341,7 @@ async def scrape_thread_contents(thread_urls_file: str, output_file: str):
     
     print(f"Scraping {len(urls)} threads...")
     
-    async with ThreadScraper(max_concurrent=3) as scraper:
+    async with ThreadScraper() as scraper:
         results = await scraper.scrape_threads(urls)
     
     # Save results